@@ -35,6 +35,11 @@ if SECRET_KEY == "dont_spill_the_beans":
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config("DEBUG", default=False, cast=bool)
 
+# Raise instead of logging when an API endpoint goes over its query/latency budget (see elevator/budgets.py)
+QUERY_BUDGET_STRICT = config("QUERY_BUDGET_STRICT", default=DEBUG, cast=bool)
+# Tests always run with QUERY_BUDGET_STRICT on
+TEST_RUNNER = "elevator.test_runner.QueryBudgetTestRunner"
+
 ALLOWED_HOSTS = config("ALLOWED_HOSTS", default=list, cast=list)
 
 
@@ -0,0 +1,91 @@
+import logging
+import math
+import re
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+# Number of latest requests per endpoint used to compute the p95 latency
+LATENCY_WINDOW_SIZE = 100
+# p95 is not meaningful for a handful of requests, so it is only checked once the window has enough samples
+LATENCY_MIN_SAMPLES = 20
+SAVEPOINT_SQL_PREFIXES = ("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class QueryBudget:
+    max_queries: int
+    max_p95_ms: int
+
+
+def fingerprint_sql(sql: str) -> str:
+    """
+    Normalizes the SQL so that the same query with different parameters is grouped together.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+\b", "?", sql)
+    sql = re.sub(r"%s", "?", sql)
+    sql = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(...)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+class QueryBudgetMixin:
+    """
+    Checks every request against the budget declared for its action in `query_budgets`, for example:
+        query_budgets = {"list": QueryBudget(max_queries=2, max_p95_ms=200)}
+    When QUERY_BUDGET_STRICT is on (it defaults to DEBUG, and QueryBudgetTestRunner turns it on for the tests), an
+    overrun raises QueryBudgetExceeded. Otherwise the overrun is logged with the fingerprints of the queries that were
+    executed.
+    """
+    query_budgets: dict[str, QueryBudget] = {}
+    _latency_samples: dict[str, deque] = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW_SIZE))
+
+    def dispatch(self, request, *args, **kwargs):
+        executed_queries = []
+
+        def record_query(execute, sql, params, many, context):
+            # Savepoints are only emitted when transaction.atomic() is nested, e.g. inside a test transaction
+            if not sql.startswith(SAVEPOINT_SQL_PREFIXES):
+                executed_queries.append(sql)
+            return execute(sql, params, many, context)
+
+        started_at = time.perf_counter()
+        with connection.execute_wrapper(record_query):
+            response = super(QueryBudgetMixin, self).dispatch(request, *args, **kwargs)
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        self.check_query_budget(executed_queries, elapsed_ms)
+        return response
+
+    def check_query_budget(self, executed_queries: list[str], elapsed_ms: float) -> None:
+        budget = self.query_budgets.get(getattr(self, "action", None))
+        if not budget:
+            return
+        endpoint = f"{self.__class__.__name__}.{self.action}"
+        latency_samples = self._latency_samples[endpoint]
+        latency_samples.append(elapsed_ms)
+
+        errors = []
+        if len(executed_queries) > budget.max_queries:
+            errors.append(f"{len(executed_queries)} queries executed, budget is {budget.max_queries}")
+        if len(latency_samples) >= LATENCY_MIN_SAMPLES:
+            p95_ms = sorted(latency_samples)[math.ceil(len(latency_samples) * 0.95) - 1]
+            if p95_ms > budget.max_p95_ms:
+                errors.append(f"p95 latency is {p95_ms:.1f}ms, budget is {budget.max_p95_ms}ms")
+        if not errors:
+            return
+
+        fingerprints = Counter(fingerprint_sql(sql) for sql in executed_queries)
+        message = f"{endpoint} is over budget: {'; '.join(errors)}. Queries:\n" + \
+            "\n".join(f"{count} x {fingerprint}" for fingerprint, count in fingerprints.most_common())
+        if getattr(settings, "QUERY_BUDGET_STRICT", settings.DEBUG):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.5 on 2026-10-19 15:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import elevator.models
+import enumchoicefield.fields
+
+
+def create_elevator_statuses(apps, schema_editor):
+    Elevator = apps.get_model("elevator", "Elevator")
+    ElevatorStatus = apps.get_model("elevator", "ElevatorStatus")
+    elevator_statuses = []
+    for elevator in Elevator.objects.all():
+        pending_elevator_requests = elevator.elevatorrequest.filter(is_completed=False).order_by("id")
+        next_elevator_request = pending_elevator_requests.first()
+        direction = None
+        if next_elevator_request:
+            if next_elevator_request.pick_from_floor_number > next_elevator_request.drop_at_floor_number:
+                direction = "Going Down"
+            else:
+                direction = "Going Up"
+        elevator_statuses.append(
+            ElevatorStatus(
+                elevator=elevator,
+                state=elevator.state,
+                current_floor=elevator.current_floor,
+                next_floor=next_elevator_request.pick_from_floor_number if next_elevator_request else None,
+                direction=direction,
+                pending_requests_count=pending_elevator_requests.count(),
+            )
+        )
+    ElevatorStatus.objects.bulk_create(elevator_statuses)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("elevator", "0002_elevatorrequest"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ElevatorStatus",
+            fields=[
+                (
+                    "elevator",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="status",
+                        serialize=False,
+                        to="elevator.elevator",
+                    ),
+                ),
+                (
+                    "state",
+                    enumchoicefield.fields.EnumChoiceField(
+                        default=elevator.models.ElevatorState["IDLE"],
+                        enum_class=elevator.models.ElevatorState,
+                        help_text="Shows the current state of Elevator",
+                        max_length=17,
+                    ),
+                ),
+                (
+                    "current_floor",
+                    models.IntegerField(default=0, help_text="Show the current floor"),
+                ),
+                (
+                    "next_floor",
+                    models.IntegerField(
+                        blank=True,
+                        help_text="Floor where the oldest pending request is waiting for the elevator",
+                        null=True,
+                    ),
+                ),
+                (
+                    "direction",
+                    models.CharField(
+                        blank=True,
+                        help_text="Direction of the oldest pending request",
+                        max_length=10,
+                        null=True,
+                    ),
+                ),
+                (
+                    "pending_requests_count",
+                    models.IntegerField(
+                        default=0, help_text="Number of requests that are not completed"
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(create_elevator_statuses, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-19 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("elevator", "0003_elevatorstatus"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="elevatorrequest",
+            name="is_cancelled",
+            field=models.BooleanField(
+                default=False,
+                help_text="Shows if the request was cancelled because the elevator can't serve it anymore (under maintenance or floor not in use)",
+            ),
+        ),
+    ]
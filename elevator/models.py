@@ -12,6 +12,25 @@ class ElevatorState(Enum):
     UNDER_MAINTENANCE = auto()
 
 
+class ElevatorQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        elevators = super(ElevatorQuerySet, self).bulk_create(objs, *args, **kwargs)
+        # bulk_create doesn't call save(), so the fleet status rows are created here as well
+        saved_elevators = [elevator for elevator in elevators if elevator.pk is not None]
+        ElevatorStatus.objects.bulk_create([ElevatorStatus(elevator=elevator, state=elevator.state,
+                                                           current_floor=elevator.current_floor)
+                                            for elevator in saved_elevators], ignore_conflicts=True)
+        if len(saved_elevators) < len(elevators):
+            # With ignore_conflicts/update_conflicts the primary keys are not set, so the rows are created for every
+            # elevator that doesn't have one yet
+            ElevatorStatus.objects.bulk_create([
+                ElevatorStatus(elevator_id=elevator["id"], state=elevator["state"],
+                               current_floor=elevator["current_floor"])
+                for elevator in self.model.objects.filter(status__isnull=True).values("id", "state", "current_floor")
+            ], ignore_conflicts=True)
+        return elevators
+
+
 class Elevator(models.Model):
     name = models.CharField(max_length=30, help_text="Name of the elevator")
     state = EnumChoiceField(ElevatorState, default=ElevatorState.IDLE,
@@ -22,9 +41,18 @@ class Elevator(models.Model):
     capacity_in_person = models.IntegerField(default=1, help_text="Maximum number of people allowed in the elevator")
     current_floor = models.IntegerField(help_text="Show the current floor")
 
+    objects = ElevatorQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        is_new_elevator = self._state.adding
+        super(Elevator, self).save(*args, **kwargs)
+        # Every elevator has a fleet status row, so that it is listed by the fleet status API
+        if is_new_elevator:
+            ElevatorStatus.objects.create(elevator=self, state=self.state, current_floor=self.current_floor)
+
 
 class ElevatorRequest(models.Model):
     elevator = models.ForeignKey(Elevator, on_delete=models.PROTECT, related_name='elevatorrequest')
@@ -33,8 +61,26 @@ class ElevatorRequest(models.Model):
     number_of_passengers = models.IntegerField(help_text="Number of passengers that are waiting for the elevator",
                                                default=0)
     is_completed = models.BooleanField(default=False, help_text="Shows if the request is completed")
+    is_cancelled = models.BooleanField(default=False,
+                                       help_text="Shows if the request was cancelled because the elevator can't "
+                                                 "serve it anymore (under maintenance or floor not in use)")
     created_date = models.DateTimeField(auto_now_add=True, help_text="Date and time when the request was created")
 
     def __str__(self):
         return f"{self.elevator.name} requests"
 
+
+class ElevatorStatus(models.Model):
+    # Denormalized summary of an elevator, kept up to date by the dispatch and processing paths (see utils.py)
+    elevator = models.OneToOneField(Elevator, on_delete=models.CASCADE, primary_key=True, related_name='status')
+    state = EnumChoiceField(ElevatorState, default=ElevatorState.IDLE,
+                            help_text="Shows the current state of Elevator")
+    current_floor = models.IntegerField(default=0, help_text="Show the current floor")
+    next_floor = models.IntegerField(null=True, blank=True,
+                                     help_text="Floor where the oldest pending request is waiting for the elevator")
+    direction = models.CharField(max_length=10, null=True, blank=True,
+                                 help_text="Direction of the oldest pending request")
+    pending_requests_count = models.IntegerField(default=0, help_text="Number of requests that are not completed")
+
+    def __str__(self):
+        return f"{self.elevator.name} status"
@@ -1,8 +1,11 @@
 import json
 
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
 from rest_framework import serializers
 from elevator.models import Elevator, ElevatorState, ElevatorRequest
-from elevator.utils import find_the_closest_elevator
+from elevator.utils import find_the_closest_elevator, get_elevator_direction, add_elevator_request_to_status, \
+    refresh_elevator_statuses
 
 
 class ElevatorRequestSerializer(serializers.ModelSerializer):
@@ -26,23 +29,26 @@ class ElevatorSerializer(serializers.ModelSerializer):
         model = Elevator
         fields = '__all__'
 
+    @staticmethod
+    def get_next_elevator_request(obj) -> ElevatorRequest | None:
+        # Reads the requests prefetched by ElevatorViewSet, so listing elevators doesn't query once per elevator
+        pending_elevator_requests = [elevator_request for elevator_request in obj.elevatorrequest.all()
+                                     if not elevator_request.is_completed and not elevator_request.is_cancelled]
+        return min(pending_elevator_requests, key=lambda elevator_request: elevator_request.id, default=None)
+
     def get_next_floor_details(self, obj):
-        elevator_requests = obj.elevatorrequest.filter(is_completed=False)
-        if elevator_requests.exists():
-            elevator_request = elevator_requests.first()
+        elevator_request = self.get_next_elevator_request(obj)
+        if elevator_request:
             return {"next_floor": elevator_request.pick_from_floor_number,
                     "number_of_passengers": elevator_request.number_of_passengers,
                     "drop_at_floor_number": elevator_request.drop_at_floor_number}
         return None
 
     def get_elevator_direction(self, obj):
-        elevator_requests = obj.elevatorrequest.filter(is_completed=False)
-        if elevator_requests.exists():
-            elevator_request = elevator_requests.first()
-            if elevator_request.pick_from_floor_number > elevator_request.drop_at_floor_number:
-                return "Going Down"
-            else:
-                return "Going Up"
+        elevator_request = self.get_next_elevator_request(obj)
+        if elevator_request:
+            return get_elevator_direction(elevator_request.pick_from_floor_number,
+                                          elevator_request.drop_at_floor_number)
         return None
 
     def validate(self, attrs) -> dict:
@@ -69,11 +75,104 @@ class ElevatorSerializer(serializers.ModelSerializer):
         return validated_data
 
     def to_representation(self, instance) -> dict:
+        # elevator_requests, next_floor_details and elevator_direction all read the requests, they are fetched once
+        # here when ElevatorViewSet hasn't prefetched them (e.g. after create or update)
+        prefetch_related_objects([instance], 'elevatorrequest')
         data = super(ElevatorSerializer, self).to_representation(instance)
         data["state"] = instance.state.name
         return data
 
 
+class ElevatorBulkFilterSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, allow_empty=False)
+    name = serializers.CharField(required=False)
+    state = serializers.CharField(required=False)
+
+    def validate(self, attrs) -> dict:
+        validated_data = super().validate(attrs)
+        if not validated_data:
+            raise serializers.ValidationError("At least one of ids, name or state is required")
+        if validated_data.get('state'):
+            try:
+                validated_data['state'] = ElevatorState[validated_data.get('state').upper()]
+            except KeyError:
+                raise serializers.ValidationError({"state": "Invalid state"})
+        return validated_data
+
+
+class ElevatorBulkUpdateSerializer(serializers.Serializer):
+    # Fields that make sense to change for a whole bank of elevators at once
+    BULK_UPDATE_FIELDS = ["state", "total_number_of_floors", "floors_not_in_use", "capacity_in_person"]
+
+    filter = ElevatorBulkFilterSerializer(required=True)
+    update = serializers.DictField(required=True, allow_empty=False)
+
+    def validate_update(self, value) -> dict:
+        unknown_fields = set(value) - set(self.BULK_UPDATE_FIELDS)
+        if unknown_fields:
+            raise serializers.ValidationError(f"Only {', '.join(self.BULK_UPDATE_FIELDS)} can be updated in bulk")
+        # Validate the update once, the same way a single elevator PATCH is validated
+        elevator_serializer = ElevatorSerializer(data=value, partial=True)
+        elevator_serializer.is_valid(raise_exception=True)
+        return dict(elevator_serializer.validated_data)
+
+    def validate(self, attrs) -> dict:
+        validated_data = super().validate(attrs)
+        elevator_filter = validated_data.get("filter")
+        elevators_query_set = Elevator.objects.all()
+        if elevator_filter.get("ids"):
+            elevators_query_set = elevators_query_set.filter(id__in=elevator_filter.get("ids"))
+        if elevator_filter.get("name"):
+            elevators_query_set = elevators_query_set.filter(name__icontains=elevator_filter.get("name"))
+        if elevator_filter.get("state"):
+            elevators_query_set = elevators_query_set.filter(state=elevator_filter.get("state"))
+        validated_data['elevators'] = elevators_query_set
+        return validated_data
+
+    def validate_elevators(self, elevators_query_set, update: dict) -> None:
+        """
+        Checks that ElevatorSerializer can only do against the payload are done against the affected rows.
+        """
+        floors_not_in_use = update.get("floors_not_in_use")
+        if not floors_not_in_use:
+            return
+        if not update.get("total_number_of_floors") and \
+                elevators_query_set.filter(total_number_of_floors__lt=max(floors_not_in_use)).exists():
+            raise serializers.ValidationError({"update": {"floors_not_in_use": ["Floors not in use must be less than Total number of floors"]}})
+        if elevators_query_set.filter(current_floor__in=floors_not_in_use).exists():
+            raise serializers.ValidationError({"update": {"floors_not_in_use": ["Current floor must not be in floors not in use"]}})
+
+    def update_elevators(self) -> dict:
+        """
+        Applies the update to all the elevators matching the filter with a single UPDATE query.
+        Pending requests of these elevators that can't be served anymore (elevator under maintenance or floor not in
+        use) are cancelled, so that they are no longer the next stop of the elevator, and their number is returned in
+        the summary.
+        """
+        update = self.validated_data.get("update")
+        with transaction.atomic():
+            # Lock the matching rows so that the checks and the summary reflect exactly the elevators that are updated
+            elevator_ids = list(self.validated_data.get("elevators").select_for_update().order_by("id")
+                                .values_list("id", flat=True))
+            elevators_query_set = Elevator.objects.filter(id__in=elevator_ids)
+            self.validate_elevators(elevators_query_set, update)
+            updated_count = elevators_query_set.update(**update)
+            cancelled_requests_count = 0
+            pending_elevator_requests = ElevatorRequest.objects.filter(elevator_id__in=elevator_ids, is_completed=False,
+                                                                       is_cancelled=False)
+            if update.get("state") == ElevatorState.UNDER_MAINTENANCE:
+                cancelled_requests_count = pending_elevator_requests.update(is_cancelled=True)
+            elif update.get("floors_not_in_use"):
+                cancelled_requests_count = pending_elevator_requests.filter(
+                    Q(pick_from_floor_number__in=update.get("floors_not_in_use")) |
+                    Q(drop_at_floor_number__in=update.get("floors_not_in_use"))).update(is_cancelled=True)
+            refresh_elevator_statuses(elevator_ids)
+        return {"updated_count": updated_count,
+                "elevator_ids": elevator_ids,
+                "updated_fields": sorted(update.keys()),
+                "cancelled_requests_count": cancelled_requests_count}
+
+
 class CreateElevatorRequestSerializer(serializers.ModelSerializer):
     pick_from_floor_number = serializers.IntegerField(required=True, min_value=0)
     drop_at_floor_number = serializers.IntegerField(required=True, min_value=0)
@@ -106,10 +205,26 @@ class CreateElevatorRequestSerializer(serializers.ModelSerializer):
             # Update the state of elevator to USER_STOP
             elevator_object.state = ElevatorState.USER_STOP
             elevator_object.save(update_fields=['state'])
-        return super(CreateElevatorRequestSerializer, self).create(validated_data)
+        elevator_request_object = super(CreateElevatorRequestSerializer, self).create(validated_data)
+        add_elevator_request_to_status(elevator_request_object)
+        return elevator_request_object
 
     def to_representation(self, instance) -> dict:
         data = super(CreateElevatorRequestSerializer, self).to_representation(instance)
-        data.pop('stop_elevator')
+        data.pop('stop_elevator', None)
         data['elevator'] = instance.elevator_id
         return data
+
+
+def serialize_fleet_status(fleet_status_rows) -> list[dict]:
+    """
+    Serializes the rows of ElevatorStatus.objects.values(). The fleet status is polled by dashboards, so it is
+    built by hand instead of going through DRF fields.
+    """
+    return [{"id": fleet_status_row["elevator_id"],
+             "state": fleet_status_row["state"].name,
+             "current_floor": fleet_status_row["current_floor"],
+             "next_floor": fleet_status_row["next_floor"],
+             "direction": fleet_status_row["direction"],
+             "pending_requests_count": fleet_status_row["pending_requests_count"]}
+            for fleet_status_row in fleet_status_rows]
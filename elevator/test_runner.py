@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """
+    Makes every test fail loudly when an API goes over its query/latency budget, whatever DEBUG is set to.
+    """
+    def setup_test_environment(self, **kwargs):
+        super(QueryBudgetTestRunner, self).setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
@@ -1,3 +1,380 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from elevator.budgets import QueryBudget, QueryBudgetExceeded, QueryBudgetMixin, fingerprint_sql, \
+    LATENCY_MIN_SAMPLES
+from elevator.models import Elevator, ElevatorRequest, ElevatorState, ElevatorStatus
+from elevator.utils import refresh_elevator_statuses, add_elevator_request_to_status
+from elevator.views import ElevatorViewSet
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Every endpoint is called with 10 and with 1,000 elevators. The number of queries must be the same for both,
+    and must fit the budget declared on the view set (an overrun raises QueryBudgetExceeded).
+    """
+    SMALL_FLEET_SIZE = 10
+    LARGE_FLEET_SIZE = 1000
+
+    def setUp(self):
+        QueryBudgetMixin._latency_samples.clear()
+
+    def create_elevators(self, number_of_elevators: int) -> None:
+        number_of_existing_elevators = Elevator.objects.count()
+        elevators = Elevator.objects.bulk_create([
+            Elevator(name=f"Elevator {number_of_existing_elevators + index}", total_number_of_floors=20,
+                     floors_not_in_use=[], capacity_in_person=10, current_floor=index % 20)
+            for index in range(number_of_elevators)
+        ])
+        elevator_requests = []
+        for elevator in elevators:
+            elevator_requests.append(ElevatorRequest(elevator=elevator, pick_from_floor_number=1,
+                                                     drop_at_floor_number=5, number_of_passengers=2,
+                                                     is_completed=True))
+            elevator_requests.append(ElevatorRequest(elevator=elevator, pick_from_floor_number=10,
+                                                     drop_at_floor_number=3, number_of_passengers=4))
+        ElevatorRequest.objects.bulk_create(elevator_requests)
+
+    def count_queries(self, method: str, url: str, data: dict | None = None, expected_status: int = 200) -> int:
+        with CaptureQueriesContext(connection) as captured_queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        self.assertEqual(response.status_code, expected_status, response.content)
+        return len(captured_queries)
+
+    def assert_queries_do_not_grow(self, method: str, url_or_factory, data: dict | None = None,
+                                   expected_status: int = 200) -> None:
+        """
+        url_or_factory can be a callable for endpoints that change the data they are called on.
+        """
+        get_url = url_or_factory if callable(url_or_factory) else lambda: url_or_factory
+        self.create_elevators(self.SMALL_FLEET_SIZE)
+        small_fleet_queries = self.count_queries(method, get_url(), data, expected_status)
+        self.create_elevators(self.LARGE_FLEET_SIZE - self.SMALL_FLEET_SIZE)
+        large_fleet_queries = self.count_queries(method, get_url(), data, expected_status)
+        self.assertEqual(small_fleet_queries, large_fleet_queries)
+
+    def pending_elevator_request_id(self) -> int:
+        return ElevatorRequest.objects.filter(is_completed=False).order_by("-id").values_list("id", flat=True)[0]
+
+    def test_list_elevators(self):
+        self.assert_queries_do_not_grow("get", "/api/elevator/")
+
+    def test_filter_elevators(self):
+        self.assert_queries_do_not_grow("get", "/api/elevator/?requests=not_completed")
+
+    def test_retrieve_elevator(self):
+        self.assert_queries_do_not_grow("get", lambda: f"/api/elevator/{Elevator.objects.last().id}/")
+
+    def test_create_elevator(self):
+        self.assert_queries_do_not_grow("post", "/api/elevator/", {"name": "Elevator", "total_number_of_floors": 10,
+                                                                   "capacity_in_person": 5, "current_floor": 0},
+                                        expected_status=201)
+
+    def test_partial_update_elevator(self):
+        self.assert_queries_do_not_grow("patch", lambda: f"/api/elevator/{Elevator.objects.last().id}/",
+                                        {"state": "under_maintenance"})
+
+    def test_bulk_update_elevators(self):
+        self.assert_queries_do_not_grow("patch", "/api/elevator/bulk/",
+                                        {"filter": {"name": "Elevator"},
+                                         "update": {"state": "idle", "floors_not_in_use": [20]}})
+
+    def test_list_elevator_requests(self):
+        self.assert_queries_do_not_grow("get", "/api/elevator-request/")
+
+    def test_retrieve_elevator_request(self):
+        self.assert_queries_do_not_grow("get", lambda: f"/api/elevator-request/{ElevatorRequest.objects.last().id}/")
+
+    def test_create_elevator_request(self):
+        self.assert_queries_do_not_grow("post", "/api/elevator-request/", {"pick_from_floor_number": 2,
+                                                                           "drop_at_floor_number": 8,
+                                                                           "number_of_passengers": 3},
+                                        expected_status=201)
+
+    def test_update_elevator_request(self):
+        self.assert_queries_do_not_grow("put", lambda: f"/api/elevator-request/{self.pending_elevator_request_id()}/",
+                                        {"pick_from_floor_number": 4, "drop_at_floor_number": 12,
+                                         "number_of_passengers": 2})
+
+    def test_partial_update_elevator_request(self):
+        self.assert_queries_do_not_grow("patch", lambda: f"/api/elevator-request/{self.pending_elevator_request_id()}/",
+                                        {"pick_from_floor_number": 4, "drop_at_floor_number": 12,
+                                         "number_of_passengers": 2})
+
+    def test_destroy_elevator_request(self):
+        self.assert_queries_do_not_grow("delete",
+                                        lambda: f"/api/elevator-request/{self.pending_elevator_request_id()}/",
+                                        expected_status=204)
+
+    def test_process_elevator_requests(self):
+        self.assert_queries_do_not_grow(
+            "post", lambda: f"/api/elevator-request/{self.pending_elevator_request_id()}/process_elevator_requests/")
+
+    def test_fleet_status(self):
+        self.assert_queries_do_not_grow("get", "/api/fleet-status/")
+
+    def test_over_budget_raises_in_strict_mode(self):
+        self.create_elevators(self.SMALL_FLEET_SIZE)
+        query_budgets = {**ElevatorViewSet.query_budgets, "list": QueryBudget(max_queries=1, max_p95_ms=500)}
+        with mock.patch.object(ElevatorViewSet, "query_budgets", query_budgets), \
+                self.assertRaises(QueryBudgetExceeded):
+            self.client.get("/api/elevator/")
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_over_budget_is_logged_otherwise(self):
+        self.create_elevators(self.SMALL_FLEET_SIZE)
+        query_budgets = {**ElevatorViewSet.query_budgets, "list": QueryBudget(max_queries=1, max_p95_ms=500)}
+        with mock.patch.object(ElevatorViewSet, "query_budgets", query_budgets), \
+                self.assertLogs("elevator.budgets", level="WARNING") as logs:
+            response = self.client.get("/api/elevator/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ElevatorViewSet.list is over budget: 2 queries executed, budget is 1", logs.output[0])
+        self.assertIn('FROM "elevator_elevatorrequest" WHERE "elevator_elevatorrequest"."elevator_id" IN (...)',
+                      logs.output[0])
+
+    def test_strict_mode_is_on_for_the_test_run(self):
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+
+    def fill_latency_window(self, elapsed_ms: float) -> None:
+        # The request itself adds the last sample, the p95 is then checked against the budget
+        QueryBudgetMixin._latency_samples["ElevatorViewSet.list"].extend([elapsed_ms] * (LATENCY_MIN_SAMPLES - 1))
+
+    def test_latency_under_budget(self):
+        self.fill_latency_window(elapsed_ms=1)
+        response = self.client.get("/api/elevator/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_p95_latency_over_budget_raises_in_strict_mode(self):
+        self.fill_latency_window(elapsed_ms=1000)
+        with self.assertRaisesRegex(QueryBudgetExceeded, "p95 latency is 1000.0ms, budget is 500ms"):
+            self.client.get("/api/elevator/")
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_p95_latency_over_budget_is_logged_otherwise(self):
+        self.fill_latency_window(elapsed_ms=1000)
+        with self.assertLogs("elevator.budgets", level="WARNING") as logs:
+            response = self.client.get("/api/elevator/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ElevatorViewSet.list is over budget: p95 latency is 1000.0ms, budget is 500ms", logs.output[0])
+
+    def test_savepoints_are_not_counted(self):
+        self.create_elevators(self.SMALL_FLEET_SIZE)
+        query_budgets = {**ElevatorViewSet.query_budgets,
+                         "bulk_update_elevators": QueryBudget(max_queries=4, max_p95_ms=200)}
+        # Without floors_not_in_use there are no EXISTS checks, so 4 queries are left once savepoints are skipped
+        with mock.patch.object(ElevatorViewSet, "query_budgets", query_budgets):
+            response = self.client.patch("/api/elevator/bulk/", {"filter": {"name": "Elevator"},
+                                                                 "update": {"capacity_in_person": 8}}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+    def test_fingerprint_sql(self):
+        self.assertEqual(fingerprint_sql("SELECT * FROM elevator WHERE id IN (1, 2, 3) AND name = 'A'  AND floor = %s"),
+                         "SELECT * FROM elevator WHERE id IN (...) AND name = ? AND floor = ?")
+
+
+class ElevatorBulkUpdateTestCase(APITestCase):
+    def setUp(self):
+        self.elevators = [
+            Elevator.objects.create(name="Block A 1", total_number_of_floors=10, capacity_in_person=5, current_floor=0),
+            Elevator.objects.create(name="Block A 2", total_number_of_floors=20, capacity_in_person=5, current_floor=3,
+                                    state=ElevatorState.MOVING),
+            Elevator.objects.create(name="Block B 1", total_number_of_floors=20, capacity_in_person=5, current_floor=0),
+        ]
+
+    def bulk_update(self, elevator_filter: dict, update: dict):
+        return self.client.patch("/api/elevator/bulk/", {"filter": elevator_filter, "update": update}, format="json")
+
+    def test_filter_is_required(self):
+        response = self.bulk_update({}, {"state": "idle"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"filter": {"non_field_errors": ["At least one of ids, name or state is required"]}})
+
+    def test_only_bulk_update_fields_are_allowed(self):
+        response = self.bulk_update({"name": "Block"}, {"current_floor": 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("update", response.json())
+        self.assertEqual(Elevator.objects.filter(current_floor=1).count(), 0)
+
+    def test_invalid_state(self):
+        self.assertEqual(self.bulk_update({"state": "flying"}, {"state": "idle"}).json(),
+                         {"filter": {"state": ["Invalid state"]}})
+        self.assertEqual(self.bulk_update({"name": "Block"}, {"state": "flying"}).json(),
+                         {"update": {"state": ["Invalid state"]}})
+
+    def test_floors_not_in_use_above_total_number_of_floors(self):
+        response = self.bulk_update({"name": "Block"}, {"floors_not_in_use": [15]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(),
+                         {"update": {"floors_not_in_use": ["Floors not in use must be less than Total number of floors"]}})
+        response = self.bulk_update({"name": "Block"}, {"floors_not_in_use": [15], "total_number_of_floors": 20})
+        self.assertEqual(response.status_code, 200)
+
+    def test_floors_not_in_use_with_current_floor(self):
+        response = self.bulk_update({"name": "Block"}, {"floors_not_in_use": [3]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(),
+                         {"update": {"floors_not_in_use": ["Current floor must not be in floors not in use"]}})
+        self.assertFalse(Elevator.objects.filter(floors_not_in_use__isnull=False).exists())
+
+    def test_filters_are_combined(self):
+        response = self.bulk_update({"name": "Block A", "state": "idle"}, {"capacity_in_person": 8})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"updated_count": 1, "elevator_ids": [self.elevators[0].id],
+                                           "updated_fields": ["capacity_in_person"], "cancelled_requests_count": 0})
+        self.assertEqual(list(Elevator.objects.filter(capacity_in_person=8)), [self.elevators[0]])
+
+    def create_elevator_request(self, elevator: Elevator, pick_from_floor_number: int,
+                                drop_at_floor_number: int) -> ElevatorRequest:
+        elevator_request = ElevatorRequest.objects.create(elevator=elevator,
+                                                          pick_from_floor_number=pick_from_floor_number,
+                                                          drop_at_floor_number=drop_at_floor_number,
+                                                          number_of_passengers=1)
+        refresh_elevator_statuses([elevator.id])
+        return elevator_request
+
+    def get_fleet_status(self, elevator: Elevator) -> dict:
+        return next(fleet_status for fleet_status in self.client.get("/api/fleet-status/").json()
+                    if fleet_status["id"] == elevator.id)
+
+    def test_pending_requests_are_cancelled_under_maintenance(self):
+        elevator_request = self.create_elevator_request(self.elevators[0], pick_from_floor_number=2,
+                                                        drop_at_floor_number=6)
+        self.assertEqual(self.get_fleet_status(self.elevators[0])["next_floor"], 2)
+
+        response = self.bulk_update({"ids": [self.elevators[0].id]}, {"state": "under_maintenance"})
+        self.assertEqual(response.json()["cancelled_requests_count"], 1)
+        self.assertTrue(ElevatorRequest.objects.get(id=elevator_request.id).is_cancelled)
+        self.assertEqual(self.get_fleet_status(self.elevators[0]),
+                         {"id": self.elevators[0].id, "state": "UNDER_MAINTENANCE", "current_floor": 0,
+                          "next_floor": None, "direction": None, "pending_requests_count": 0})
+        response = self.client.get(f"/api/elevator/{self.elevators[0].id}/")
+        self.assertIsNone(response.json()["next_floor_details"])
+        self.assertIsNone(response.json()["elevator_direction"])
+
+        response = self.client.post(f"/api/elevator-request/{elevator_request.id}/process_elevator_requests/")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Elevator request is cancelled"})
+        self.assertEqual(Elevator.objects.get(id=self.elevators[0].id).state, ElevatorState.UNDER_MAINTENANCE)
+
+    def test_pending_requests_are_cancelled_on_floors_not_in_use(self):
+        elevator_request = self.create_elevator_request(self.elevators[2], pick_from_floor_number=5,
+                                                        drop_at_floor_number=9)
+        self.create_elevator_request(self.elevators[2], pick_from_floor_number=2, drop_at_floor_number=6)
+        response = self.bulk_update({"ids": [self.elevators[2].id]}, {"floors_not_in_use": [9]})
+        self.assertEqual(response.json()["cancelled_requests_count"], 1)
+        self.assertTrue(ElevatorRequest.objects.get(id=elevator_request.id).is_cancelled)
+        # The request that can still be served becomes the next stop
+        fleet_status = self.get_fleet_status(self.elevators[2])
+        self.assertEqual((fleet_status["next_floor"], fleet_status["direction"], fleet_status["pending_requests_count"]),
+                         (2, "Going Up", 1))
+
+        response = self.client.post(f"/api/elevator-request/{elevator_request.id}/process_elevator_requests/")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ElevatorRequest.objects.get(id=elevator_request.id).is_completed)
+
+
+class FleetStatusTestCase(APITestCase):
+    def setUp(self):
+        response = self.client.post("/api/elevator/", {"name": "Elevator 1", "total_number_of_floors": 20,
+                                                       "capacity_in_person": 10, "current_floor": 0}, format="json")
+        self.elevator = Elevator.objects.get(id=response.json()["id"])
+
+    def create_elevator_request(self, pick_from_floor_number: int, drop_at_floor_number: int,
+                                stop_elevator: bool = False) -> int:
+        # There is only one elevator, so the request is always dispatched to it
+        response = self.client.post("/api/elevator-request/", {"pick_from_floor_number": pick_from_floor_number,
+                                                               "drop_at_floor_number": drop_at_floor_number,
+                                                               "number_of_passengers": 1,
+                                                               "stop_elevator": stop_elevator}, format="json")
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["id"]
+
+    def get_fleet_status(self) -> dict:
+        response = self.client.get("/api/fleet-status/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("max-age=2", response["Cache-Control"])
+        return response.json()[0]
+
+    def test_new_elevator(self):
+        self.assertEqual(self.get_fleet_status(), {"id": self.elevator.id, "state": "IDLE", "current_floor": 0,
+                                                   "next_floor": None, "direction": None,
+                                                   "pending_requests_count": 0})
+
+    def test_elevator_created_outside_the_api(self):
+        elevator = Elevator.objects.create(name="Elevator 2", current_floor=4)
+        [bulk_created_elevator] = Elevator.objects.bulk_create([Elevator(name="Elevator 3", current_floor=7)])
+        response = self.client.get("/api/fleet-status/")
+        self.assertEqual([(fleet_status["id"], fleet_status["current_floor"]) for fleet_status in response.json()],
+                         [(self.elevator.id, 0), (elevator.id, 4), (bulk_created_elevator.id, 7)])
+
+    def test_elevator_bulk_created_with_ignore_conflicts(self):
+        Elevator.objects.bulk_create([Elevator(name="Elevator 2", current_floor=4)], ignore_conflicts=True)
+        elevator = Elevator.objects.get(name="Elevator 2")
+        self.assertEqual(ElevatorStatus.objects.get(elevator=elevator).current_floor, 4)
+
+    def test_elevator_bulk_created_with_update_conflicts(self):
+        Elevator.objects.bulk_create([Elevator(id=self.elevator.id, name="Elevator 1 renamed", current_floor=0),
+                                      Elevator(name="Elevator 2", current_floor=6)],
+                                     update_conflicts=True, unique_fields=["id"], update_fields=["name"])
+        self.assertEqual(Elevator.objects.get(id=self.elevator.id).name, "Elevator 1 renamed")
+        elevator = Elevator.objects.get(name="Elevator 2")
+        self.assertEqual(ElevatorStatus.objects.get(elevator=elevator).current_floor, 6)
+        self.assertEqual(ElevatorStatus.objects.count(), 2)
+
+    def test_requests_dispatched_out_of_order(self):
+        older_elevator_request = ElevatorRequest.objects.create(elevator=self.elevator, pick_from_floor_number=5,
+                                                                drop_at_floor_number=2, number_of_passengers=1)
+        newer_elevator_request = ElevatorRequest.objects.create(elevator=self.elevator, pick_from_floor_number=3,
+                                                                drop_at_floor_number=9, number_of_passengers=1)
+        # The status update of the newer request runs first, as it can with concurrent dispatches
+        add_elevator_request_to_status(newer_elevator_request)
+        add_elevator_request_to_status(older_elevator_request)
+        fleet_status = self.get_fleet_status()
+        self.assertEqual((fleet_status["next_floor"], fleet_status["direction"], fleet_status["pending_requests_count"]),
+                         (5, "Going Down", 2))
+
+    def test_dispatch_and_process(self):
+        first_elevator_request_id = self.create_elevator_request(pick_from_floor_number=5, drop_at_floor_number=2)
+        self.create_elevator_request(pick_from_floor_number=3, drop_at_floor_number=9)
+        fleet_status = self.get_fleet_status()
+        self.assertEqual((fleet_status["next_floor"], fleet_status["direction"], fleet_status["pending_requests_count"]),
+                         (5, "Going Down", 2))
+
+        response = self.client.post(f"/api/elevator-request/{first_elevator_request_id}/process_elevator_requests/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()["is_completed"])
+        self.assertEqual(self.get_fleet_status(), {"id": self.elevator.id, "state": "DOOR_CLOSE", "current_floor": 2,
+                                                   "next_floor": 3, "direction": "Going Up",
+                                                   "pending_requests_count": 1})
+
+    def test_stop_elevator(self):
+        self.create_elevator_request(pick_from_floor_number=5, drop_at_floor_number=2, stop_elevator=True)
+        self.assertEqual(self.get_fleet_status(), {"id": self.elevator.id, "state": "USER_STOP", "current_floor": 0,
+                                                   "next_floor": None, "direction": None,
+                                                   "pending_requests_count": 0})
+
+    def test_edit_and_delete_elevator_request(self):
+        elevator_request_id = self.create_elevator_request(pick_from_floor_number=5, drop_at_floor_number=2)
+        response = self.client.patch(f"/api/elevator-request/{elevator_request_id}/",
+                                     {"pick_from_floor_number": 6, "drop_at_floor_number": 8,
+                                      "number_of_passengers": 1}, format="json")
+        self.assertEqual(response.status_code, 200)
+        fleet_status = self.get_fleet_status()
+        self.assertEqual((fleet_status["next_floor"], fleet_status["direction"], fleet_status["pending_requests_count"]),
+                         (6, "Going Up", 1))
+
+        response = self.client.delete(f"/api/elevator-request/{elevator_request_id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_fleet_status()["pending_requests_count"], 0)
+
+    def test_bulk_update(self):
+        response = self.client.patch("/api/elevator/bulk/", {"filter": {"ids": [self.elevator.id]},
+                                                             "update": {"state": "under_maintenance"}}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(ElevatorStatus.objects.get(elevator=self.elevator).state, ElevatorState.UNDER_MAINTENANCE)
+        self.assertEqual(self.get_fleet_status()["state"], "UNDER_MAINTENANCE")
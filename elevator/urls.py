@@ -1,12 +1,13 @@
 from django.urls import re_path, include
 from rest_framework import routers
 
-from elevator.views import ElevatorViewSet, ElevatorRequestViewSet
+from elevator.views import ElevatorViewSet, ElevatorRequestViewSet, FleetStatusViewSet
 
 router = routers.DefaultRouter()
 
 
 router.register(r'elevator', ElevatorViewSet)
 router.register(r'elevator-request', ElevatorRequestViewSet)
+router.register(r'fleet-status', FleetStatusViewSet, basename='fleet-status')
 
 urlpatterns = [re_path(r"^", include(router.urls))]
@@ -1,6 +1,13 @@
-from django.db.models import Q
+from django.db.models import Q, F, Value, Count, OuterRef, Subquery, Case, When
+from django.db.models.functions import Coalesce, Greatest
 
-from elevator.models import ElevatorRequest, ElevatorState, Elevator
+from elevator.models import ElevatorRequest, ElevatorState, Elevator, ElevatorStatus
+
+
+def get_elevator_direction(pick_from_floor_number: int, drop_at_floor_number: int) -> str:
+    if pick_from_floor_number > drop_at_floor_number:
+        return "Going Down"
+    return "Going Up"
 
 
 def find_the_closest_elevator(pick_from_floor_number: int, total_number_of_passengers: int, drop_at_floor_number: int) -> Elevator | None:
@@ -18,8 +25,10 @@ def find_the_closest_elevator(pick_from_floor_number: int, total_number_of_passe
     if not elevators_query_set:
         return None
     nearest_elevator_objects = {}
-    if elevators_query_set.filter(current_floor=pick_from_floor_number):
-        return elevators_query_set.get(current_floor=pick_from_floor_number)
+    # More than one elevator can be waiting on the same floor, the oldest one is picked
+    elevator_on_same_floor = elevators_query_set.filter(current_floor=pick_from_floor_number).order_by('id').first()
+    if elevator_on_same_floor:
+        return elevator_on_same_floor
 
     # If no elevator is available on the same floor, then find the elevator that is nearest to the floor
     for elevator_object in elevators_query_set:
@@ -71,4 +80,67 @@ def process_elevator_request(elevator_request_object: ElevatorRequest) -> Elevat
     elevator_object.save(update_fields=['state'])
     elevator_request_object.is_completed = True
     elevator_request_object.save(update_fields=['is_completed'])
+    complete_elevator_request_in_status(elevator_request_object)
     return elevator_request_object
+
+
+def get_next_stop_subqueries() -> dict:
+    """
+    next_floor and direction of ElevatorStatus, computed in SQL from the oldest pending request of the elevator.
+    """
+    pending_elevator_requests = ElevatorRequest.objects.filter(elevator_id=OuterRef('elevator_id'),
+                                                               is_completed=False, is_cancelled=False).order_by('id')
+    # Same as get_elevator_direction
+    direction = Case(When(pick_from_floor_number__gt=F('drop_at_floor_number'), then=Value("Going Down")),
+                     default=Value("Going Up"))
+    return {"next_floor": Subquery(pending_elevator_requests.values('pick_from_floor_number')[:1]),
+            "direction": Subquery(pending_elevator_requests.annotate(direction=direction).values('direction')[:1])}
+
+
+def refresh_elevator_statuses(elevator_ids: list[int]) -> None:
+    """
+    Rebuilds the ElevatorStatus rows of the given elevators with a single UPDATE query. It is used when an elevator or
+    a request is edited directly, the dispatch and processing paths update the rows incrementally.
+    """
+    elevator = Elevator.objects.filter(id=OuterRef('elevator_id'))
+    pending_requests_count = ElevatorRequest.objects.filter(elevator_id=OuterRef('elevator_id'), is_completed=False,
+                                                            is_cancelled=False).order_by().values('elevator_id').annotate(count=Count('id')).values('count')
+    ElevatorStatus.objects.filter(elevator_id__in=elevator_ids).update(
+        state=Subquery(elevator.values('state')[:1]),
+        current_floor=Subquery(elevator.values('current_floor')[:1]),
+        pending_requests_count=Coalesce(Subquery(pending_requests_count), Value(0)),
+        **get_next_stop_subqueries(),
+    )
+
+
+def add_elevator_request_to_status(elevator_request_object: ElevatorRequest) -> None:
+    """
+    Called when a request is dispatched to an elevator.
+    """
+    elevator_object = elevator_request_object.elevator
+    elevator_status_query_set = ElevatorStatus.objects.filter(elevator_id=elevator_object.id)
+    if elevator_request_object.is_completed:
+        # The elevator was stopped by the user, the request is saved as completed
+        elevator_status_query_set.update(state=elevator_object.state, current_floor=elevator_object.current_floor)
+        return
+    # The next stop is read from the requests, so it stays the oldest pending request even when two requests are
+    # dispatched to the elevator at the same time
+    elevator_status_query_set.update(
+        state=elevator_object.state,
+        current_floor=elevator_object.current_floor,
+        pending_requests_count=F('pending_requests_count') + 1,
+        **get_next_stop_subqueries(),
+    )
+
+
+def complete_elevator_request_in_status(elevator_request_object: ElevatorRequest) -> None:
+    """
+    Called when a request has been processed by the elevator.
+    """
+    elevator_object = elevator_request_object.elevator
+    ElevatorStatus.objects.filter(elevator_id=elevator_object.id).update(
+        state=elevator_object.state,
+        current_floor=elevator_object.current_floor,
+        pending_requests_count=Greatest(F('pending_requests_count') - 1, Value(0)),
+        **get_next_stop_subqueries(),
+    )
@@ -1,13 +1,16 @@
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from elevator.models import Elevator, ElevatorState, ElevatorRequest
-from elevator.serializers import ElevatorSerializer, CreateElevatorRequestSerializer, ElevatorRequestSerializer
-from elevator.utils import process_elevator_request
+from elevator.budgets import QueryBudget, QueryBudgetMixin
+from elevator.models import Elevator, ElevatorState, ElevatorRequest, ElevatorStatus
+from elevator.serializers import ElevatorSerializer, CreateElevatorRequestSerializer, ElevatorRequestSerializer, \
+    ElevatorBulkUpdateSerializer, serialize_fleet_status
+from elevator.utils import process_elevator_request, refresh_elevator_statuses
 
 
-class ElevatorViewSet(viewsets.ModelViewSet):
+class ElevatorViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     Elevator API for getting and updating elevators.
     To create/update an elevator, we can use the following format:
@@ -24,11 +27,25 @@ class ElevatorViewSet(viewsets.ModelViewSet):
                 - DOOR_CLOSED
                 - USER_STOP
                 - UNDER_MAINTENANCE
+    To update many elevators at once (e.g. for a maintenance window), PATCH `bulk/` with:
+        `filter`: <dict>: {"ids": [1, 2], "name": "Block A", "state": "IDLE"} (at least one of them)
+        `update`: <dict>: {"state": "UNDER_MAINTENANCE", "floors_not_in_use": [1, 2, 3]}
+            Only state, total_number_of_floors, floors_not_in_use and capacity_in_person can be updated in bulk.
+            Pending requests of these elevators that can't be served anymore are cancelled (cancelled_requests_count).
     """
-    queryset = Elevator.objects.all()
+    # Requests are prefetched so that ElevatorSerializer doesn't query once per elevator
+    queryset = Elevator.objects.prefetch_related("elevatorrequest")
     serializer_class = ElevatorSerializer
     lookup_url_kwarg = "id"  # This is used to get the id from the url and pass it to the get_object method.
     http_method_names = ["get", "post", "patch"]
+    # Query counts must not grow with the number of elevators, see elevator/budgets.py
+    query_budgets = {
+        "list": QueryBudget(max_queries=2, max_p95_ms=500),
+        "retrieve": QueryBudget(max_queries=2, max_p95_ms=100),
+        "create": QueryBudget(max_queries=4, max_p95_ms=100),
+        "partial_update": QueryBudget(max_queries=6, max_p95_ms=100),
+        "bulk_update_elevators": QueryBudget(max_queries=6, max_p95_ms=200),
+    }
 
     def get_queryset(self):
         """
@@ -55,13 +72,36 @@ class ElevatorViewSet(viewsets.ModelViewSet):
             if requests == "completed":
                 return self.queryset.filter(elevatorrequest__is_completed=True).distinct()
             elif requests == "not_completed":
-                return self.queryset.filter(elevatorrequest__is_completed=False).distinct()
+                return self.queryset.filter(elevatorrequest__is_completed=False,
+                                            elevatorrequest__is_cancelled=False).distinct()
             else:
                 return self.queryset.none()
         return self.queryset.all()
 
+    def get_serializer_class(self):
+        """
+        This method is used to get the serializer class based on the action.
+        """
+        if self.action in ["bulk_update_elevators"]:
+            return ElevatorBulkUpdateSerializer
+        return super(ElevatorViewSet, self).get_serializer_class()
+
+    def perform_update(self, serializer):
+        super(ElevatorViewSet, self).perform_update(serializer)
+        refresh_elevator_statuses([serializer.instance.id])
+
+    @action(detail=False, methods=["patch"], url_path="bulk")
+    def bulk_update_elevators(self, request, *args, **kwargs):
+        """
+        This view is used to apply the same partial update to all the elevators matching the filter.
+        The update is validated once and applied with a single UPDATE query, see ElevatorBulkUpdateSerializer.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.update_elevators(), status=status.HTTP_200_OK)
+
 
-class ElevatorRequestViewSet(viewsets.ModelViewSet):
+class ElevatorRequestViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     """
     ElevatorRequest API for creating elevators requests.
     To create an elevator request, we can use the following format:
@@ -74,6 +114,15 @@ class ElevatorRequestViewSet(viewsets.ModelViewSet):
     """
     queryset = ElevatorRequest.objects.all()
     serializer_class = CreateElevatorRequestSerializer
+    query_budgets = {
+        "list": QueryBudget(max_queries=1, max_p95_ms=500),
+        "retrieve": QueryBudget(max_queries=1, max_p95_ms=100),
+        "create": QueryBudget(max_queries=6, max_p95_ms=200),
+        "partial_update": QueryBudget(max_queries=6, max_p95_ms=200),
+        "update": QueryBudget(max_queries=6, max_p95_ms=200),
+        "destroy": QueryBudget(max_queries=3, max_p95_ms=100),
+        "process_elevator_requests": QueryBudget(max_queries=10, max_p95_ms=200),
+    }
 
     def get_serializer_class(self):
         """
@@ -83,6 +132,16 @@ class ElevatorRequestViewSet(viewsets.ModelViewSet):
             return ElevatorRequestSerializer
         return super(ElevatorRequestViewSet, self).get_serializer_class()
 
+    def perform_update(self, serializer):
+        # The request can be assigned to another elevator, so both fleet statuses are rebuilt
+        previous_elevator_id = serializer.instance.elevator_id
+        super(ElevatorRequestViewSet, self).perform_update(serializer)
+        refresh_elevator_statuses([previous_elevator_id, serializer.instance.elevator_id])
+
+    def perform_destroy(self, instance):
+        super(ElevatorRequestViewSet, self).perform_destroy(instance)
+        refresh_elevator_statuses([instance.elevator_id])
+
     @action(detail=True, methods=["post"])
     def process_elevator_requests(self, request, *args, **kwargs):
         """
@@ -92,7 +151,37 @@ class ElevatorRequestViewSet(viewsets.ModelViewSet):
         elevator_request_object = self.get_object()
         if elevator_request_object.is_completed:
             return Response({"error": "Elevator request is completed"}, status=status.HTTP_400_BAD_REQUEST)
+        if elevator_request_object.is_cancelled:
+            return Response({"error": "Elevator request is cancelled"}, status=status.HTTP_400_BAD_REQUEST)
+        elevator_object = elevator_request_object.elevator
+        # The elevator can be put under maintenance or stop serving floors after the request was dispatched to it
+        if elevator_object.state == ElevatorState.UNDER_MAINTENANCE:
+            return Response({"error": "Elevator is under maintenance"}, status=status.HTTP_400_BAD_REQUEST)
+        if {elevator_request_object.pick_from_floor_number, elevator_request_object.drop_at_floor_number} & \
+                set(elevator_object.floors_not_in_use or []):
+            return Response({"error": "Elevator does not stop at the requested floors"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        # process_elevator_request updates elevator_request_object itself, so it doesn't need to be fetched again
         process_elevator_request(elevator_request_object)
-        elevator_request_object.refresh_from_db()
         serializer = self.get_serializer(elevator_request_object)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class FleetStatusViewSet(QueryBudgetMixin, viewsets.ViewSet):
+    """
+    Fleet status API for dashboards. It returns a summary of every elevator:
+        `id`, `state`, `current_floor`, `next_floor`, `direction` and `pending_requests_count`
+    The summary is read from ElevatorStatus, which is kept up to date when requests are dispatched and processed,
+    so the elevator requests are not serialized.
+    """
+    query_budgets = {
+        "list": QueryBudget(max_queries=1, max_p95_ms=100),
+    }
+    cache_max_age_in_seconds = 2
+
+    def list(self, request, *args, **kwargs):
+        fleet_status_rows = ElevatorStatus.objects.order_by("elevator_id").values(
+            "elevator_id", "state", "current_floor", "next_floor", "direction", "pending_requests_count")
+        response = Response(serialize_fleet_status(fleet_status_rows), status=status.HTTP_200_OK)
+        patch_cache_control(response, max_age=self.cache_max_age_in_seconds)
+        return response